@@ -1,7 +1,12 @@
+import os
+from types import MappingProxyType
+
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import pyarrow as pa
+import pyarrow.compute as pc
 import plotly.graph_objects as go
+from plotly.colors import sequential
 from datetime import datetime
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
@@ -11,14 +16,63 @@ st.set_page_config(
     layout="wide"
 )
 
+# --- CONSTANTES (mapeamentos e listas imutáveis) ---
+FAIXA_BINS = (0, 9, 19, 24, 59, 120)
+FAIXA_LABELS = ('Criança (0-9)', 'Adolescente (10-19)', 'Jovem (20-24)', 'Adulta (25-59)', 'Idosa (60+)')
+
+MAP_SINAN = MappingProxyType({1: 'Sim', 2: 'Não', 9: 'Ignorado', 3: 'Não se aplica', 8: 'Não se aplica'})
+MAP_CONJUGAL = MappingProxyType({1: 'Solteira', 2: 'Casada/União', 3: 'Viúva', 4: 'Separada', 8: 'N/A', 9: 'Ignorado'})
+MAP_SEXO = MappingProxyType({1: 'Masculino', 2: 'Feminino', 3: 'Ambos', 9: 'Ignorado'})
+
+COLS_VIOLENCIA = MappingProxyType({
+    'VIOL_FISIC': 'Física', 'VIOL_PSICO': 'Psicológica', 'VIOL_SEXU': 'Sexual', 
+    'VIOL_TORT': 'Tortura', 'VIOL_FINAN': 'Patrimonial', 'VIOL_NEGLI': 'Negligência'
+})
+
+CORES_ALCOOL = MappingProxyType({'Sim': '#FF4B4B', 'Não': '#87CEEB', 'Ignorado': '#D3D3D3'})
+
+# Versão do tratamento gravado no Feather: incremente sempre que o tratamento mudar
+VERSAO_CACHE = 2
+
 # --- FUNÇÃO DE CARREGAMENTO E CACHE ---
-@st.cache_data
-def load_data():
+def mapear_codigos(serie, mapa):
+    # Traduz via Categorical: o dicionário é aplicado às categorias, não a cada linha
+    codigos = list(mapa)
+    categorias = serie.where(serie.isin(codigos)).astype(pd.CategoricalDtype(codigos))
+    return categorias.map(mapa).fillna('Ignorado')
+
+def contar_marcados(df, cols):
+    # Conta os '1' (Sim) de cada coluna com kernels do Arrow sobre os buffers int8
+    cols = list(cols)
+    tbl = pa.Table.from_pandas(df[cols], preserve_index=False)
+    contagens = [pc.sum(pc.equal(tbl[col], 1)).as_py() or 0 for col in cols]
+    return pd.Series(contagens, index=cols, dtype='int64')
+
+def ler_dados():
     # Caminho fixo conforme solicitado
     caminho = r"C:\Users\angelo.medeiros\Documents\Violencia TIY\HGR-violencia-tiy.xlsx"
-    
+    # Cópia já tratada em Feather (colunar), gerada na primeira leitura do Excel;
+    # a versão no nome descarta cópias gravadas por um tratamento anterior
+    caminho_feather = f"{caminho}.v{VERSAO_CACHE}.feather"
+
+    try:
+        mtime_excel = os.stat(caminho).st_mtime
+    except OSError:
+        mtime_excel = None
     try:
-        df = pd.read_excel(caminho)
+        mtime_feather = os.stat(caminho_feather).st_mtime
+    except OSError:
+        mtime_feather = None
+
+    # Só volta ao Excel se o Feather não existir ou for mais antigo que a planilha
+    if mtime_feather is not None and (mtime_excel is None or mtime_feather >= mtime_excel):
+        try:
+            return pd.read_feather(caminho_feather).convert_dtypes(dtype_backend="pyarrow")
+        except Exception:
+            pass
+
+    try:
+        df = pd.read_excel(caminho, engine="calamine")
     except Exception as e:
         st.error(f"Erro ao ler o arquivo: {e}")
         return None
@@ -26,7 +80,10 @@ def load_data():
     # --- TRATAMENTO DE DADOS (Igual ao Jupyter) ---
     # 1. Filtro Sexo Feminino
     if 'CS_SEXO' in df.columns:
-        df = df[df['CS_SEXO'].isin(['F', '2', 2])].copy()
+        # Normaliza para texto (código 2, inclusive lido como 2.0, vira 'F') e compara com um único valor
+        sexo = df['CS_SEXO'].astype('string').str.strip()
+        sexo = sexo.mask(pd.to_numeric(df['CS_SEXO'], errors='coerce') == 2, 'F')
+        df = df[sexo.eq('F').fillna(False)].copy()
     
     # 2. Datas
     cols_data = ['DT_NOTIFIC', 'DT_NASC', 'DT_OCOR']
@@ -34,39 +91,182 @@ def load_data():
         if col in df.columns:
             df[col] = pd.to_datetime(df[col], errors='coerce')
     
-    df['ANO_NOTIFICACAO'] = df['DT_NOTIFIC'].dt.year
+    df['ANO_NOTIFICACAO'] = df['DT_NOTIFIC'].dt.year.astype('Int16')
+
+    # Campos codificados do SINAN (1=Sim, 2=Não, 9=Ignorado...) cabem em Int8
+    cols_codigo = [
+        c for c in df.columns
+        if c.startswith(('VIOL_', 'AG_', 'REL_')) and not c.endswith('_ESPEC')
+    ] + ['AUTOR_ALCO', 'AUTOR_SEXO', 'SIT_CONJUG']
+    for col in cols_codigo:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int8')
 
     # 3. Idade e Faixa Etária
-    df['IDADE_CALCULADA'] = (df['DT_NOTIFIC'] - df['DT_NASC']).dt.days // 365.25
-    bins = [0, 9, 19, 24, 59, 120]
-    labels = ['Criança (0-9)', 'Adolescente (10-19)', 'Jovem (20-24)', 'Adulta (25-59)', 'Idosa (60+)']
-    df['FAIXA_ETARIA'] = pd.cut(df['IDADE_CALCULADA'], bins=bins, labels=labels, right=True)
+    # Idade em anos completos: diferença de anos menos 1 se o aniversário ainda não chegou
+    notific, nasc = df['DT_NOTIFIC'].dt, df['DT_NASC'].dt
+    anos = notific.year - nasc.year
+    fez_aniversario = (notific.month * 100 + notific.day) >= (nasc.month * 100 + nasc.day)
+    df['IDADE_CALCULADA'] = (anos - (~fez_aniversario).astype('int8')).astype('Int16')
+    df['FAIXA_ETARIA'] = pd.cut(df['IDADE_CALCULADA'], bins=FAIXA_BINS, labels=FAIXA_LABELS, right=True)
 
     # 4. Mapeamentos
-    map_sinan = {1: 'Sim', 2: 'Não', 9: 'Ignorado', 3: 'Não se aplica', 8: 'Não se aplica'}
-    
     if 'AUTOR_ALCO' in df.columns:
-        df['ALCOOL_DESC'] = df['AUTOR_ALCO'].map(map_sinan).fillna('Ignorado')
+        df['ALCOOL_DESC'] = mapear_codigos(df['AUTOR_ALCO'], MAP_SINAN)
     
     # Mapeamento Conjugal
-    map_conjugal = {1: 'Solteira', 2: 'Casada/União', 3: 'Viúva', 4: 'Separada', 8: 'N/A', 9: 'Ignorado'}
     if 'SIT_CONJUG' in df.columns:
-        df['SIT_CONJUG_DESC'] = df['SIT_CONJUG'].map(map_conjugal).fillna('Ignorado')
+        df['SIT_CONJUG_DESC'] = mapear_codigos(df['SIT_CONJUG'], MAP_CONJUGAL)
+
+    # Mapeamento Sexo do Autor
+    if 'AUTOR_SEXO' in df.columns:
+        df['SEXO_AUTOR_DESC'] = mapear_codigos(df['AUTOR_SEXO'], MAP_SEXO)
+
+    # 5. Colunas em memória Arrow (contíguas, com bitmap de nulos)
+    df = df.reset_index(drop=True).convert_dtypes(dtype_backend="pyarrow")
+
+    # 6. Salva o resultado tratado para as próximas execuções
+    try:
+        df.to_feather(caminho_feather, compression="zstd")
+    except Exception as e:
+        st.warning(f"Não foi possível salvar o cache Feather: {e}")
 
     return df
 
+def contar_ano(grupo):
+    # Contagens de um único ano; o filtro da sidebar só precisa somá-las
+    cols_violencia = [c for c in COLS_VIOLENCIA if c in grupo.columns]
+    cols_meio = [
+        c for c in grupo.columns
+        if c.startswith('AG_') and c != 'AG_OUTROS' and not c.endswith('_ESPEC')
+    ]
+    cols_vinculo = [
+        c for c in grupo.columns
+        if c.startswith('REL_') and c != 'REL_TRAB' and not c.endswith('_ESPEC')
+    ]
+
+    contagens = {
+        'n': len(grupo),
+        'viol_fisica': int((grupo['VIOL_FISIC'] == 1).sum()),
+        'alcool_sim': int((grupo['AUTOR_ALCO'] == 1).sum()) if 'AUTOR_ALCO' in grupo.columns else 0,
+        'faixa': grupo['FAIXA_ETARIA'].value_counts(sort=False),
+        'violencia': contar_marcados(grupo, cols_violencia),
+        'meio': contar_marcados(grupo, cols_meio),
+        'vinculo': contar_marcados(grupo, cols_vinculo),
+    }
+    for chave, col in (('conjugal', 'SIT_CONJUG_DESC'), ('alcool', 'ALCOOL_DESC'), ('sexo', 'SEXO_AUTOR_DESC')):
+        if col in grupo.columns:
+            contagens[chave] = grupo[col].value_counts(sort=False)
+    return contagens
+
+@st.cache_data
+def load_data():
+    df = ler_dados()
+    if df is None:
+        return None
+
+    # Contagens pré-calculadas por ano de notificação, usadas pelo filtro da sidebar
+    por_ano = {int(ano): contar_ano(grupo) for ano, grupo in df.groupby('ANO_NOTIFICACAO', observed=True)}
+    return por_ano
+
+# --- FILTRO E AGREGAÇÕES (CACHE POR SELEÇÃO DE ANOS) ---
+@st.cache_data
+def filter_by_years(_por_ano, years):
+    # _por_ano vem do cache de load_data; só a seleção de anos entra na chave
+    selecionados = [_por_ano[ano] for ano in years]
+    modelo = next(iter(_por_ano.values()))
+
+    def somar(chave):
+        # Parte de zeros no formato de um ano qualquer e soma os anos selecionados
+        total = modelo[chave] * 0
+        for contagens in selecionados:
+            total = total.add(contagens[chave], fill_value=0)
+        return total.astype(int)
+
+    def ordenar(contagem, ascending=False):
+        return contagem.sort_values(ascending=ascending, kind='stable')
+
+    aggs = {}
+
+    # Faixa Etária (a mesma contagem alimenta o KPI e o gráfico)
+    vc_faixa = somar('faixa')
+    aggs['contagem_etaria'] = vc_faixa.sort_index()
+
+    # KPIs
+    total = sum(c['n'] for c in selecionados)
+    aggs['kpis'] = {
+        'total': total,
+        'viol_fisica': sum(c['viol_fisica'] for c in selecionados),
+        'alcool_sim': sum(c['alcool_sim'] for c in selecionados),
+        'top_faixa': vc_faixa.idxmax() if total > 0 else "-",
+    }
+
+    # Situação Conjugal
+    aggs['contagem_conjugal'] = None
+    if 'conjugal' in modelo:
+        contagem_conjugal = ordenar(somar('conjugal'))
+        aggs['contagem_conjugal'] = contagem_conjugal[contagem_conjugal > 0]
+
+    # Tipos de Violência (Multiplas escolhas)
+    dados_violencia = somar('violencia').rename(COLS_VIOLENCIA)
+    aggs['viol_tipo'] = ordenar(dados_violencia, ascending=True)
+
+    # Meio Utilizado (Top 5)
+    dados_meio = somar('meio')
+    dados_meio = dados_meio[dados_meio > 0].rename(lambda c: c.replace('AG_', '').title())
+    aggs['meio'] = ordenar(dados_meio).head(5)
+
+    # Vínculo
+    dados_vinculo = somar('vinculo')
+    dados_vinculo = dados_vinculo[dados_vinculo > 0].rename(lambda c: c.replace('REL_', '').title())
+    aggs['vinculo'] = ordenar(dados_vinculo).head(7)
+
+    # Uso de Álcool
+    aggs['alcool_counts'] = None
+    if 'alcool' in modelo:
+        alcool_counts = ordenar(somar('alcool'))
+        aggs['alcool_counts'] = alcool_counts[alcool_counts > 0]
+
+    # Sexo do Autor
+    aggs['sexo_counts'] = None
+    if 'sexo' in modelo:
+        sexo_counts = ordenar(somar('sexo'))
+        aggs['sexo_counts'] = sexo_counts[sexo_counts > 0]
+
+    return aggs
+
+# --- GRÁFICOS (figuras cacheadas pelos dados agregados) ---
+@st.cache_resource
+def fig_barras(x, y, titulo, eixo_x, eixo_y, cor, texto=None, orientacao='v', escala=None):
+    marker = dict(color=cor)
+    if escala is not None:
+        marker.update(colorscale=escala, colorbar=dict(title='Qtd'))
+    barra = go.Bar(x=x, y=y, text=texto, orientation=orientacao, marker=marker)
+    return go.Figure(barra).update_layout(title=titulo, xaxis_title=eixo_x, yaxis_title=eixo_y)
+
+@st.cache_resource
+def fig_pizza(rotulos, valores, titulo, cores=None, furo=None):
+    fatia = go.Pie(labels=rotulos, values=valores, marker_colors=cores, hole=furo)
+    return go.Figure(fatia).update_layout(title=titulo)
+
 # Carrega os dados
-df = load_data()
+por_ano = load_data()
 
-if df is not None:
+if por_ano is not None:
     # --- SIDEBAR (FILTROS) ---
     st.sidebar.header("Filtros")
     
-    anos_disponiveis = sorted(df['ANO_NOTIFICACAO'].dropna().unique().astype(int))
+    anos_disponiveis = sorted(por_ano)
     anos_sel = st.sidebar.multiselect("Selecione o Ano", anos_disponiveis, default=anos_disponiveis)
     
-    # Filtrar DataFrame
-    df_filtered = df[df['ANO_NOTIFICACAO'].isin(anos_sel)]
+    # Nenhum ano selecionado: não há o que agregar nem desenhar
+    if not anos_sel:
+        st.warning("Selecione ao menos um ano.")
+        st.stop()
+
+    # Agregados da seleção (cacheados por combinação de anos)
+    aggs = filter_by_years(por_ano, tuple(sorted(anos_sel)))
+    kpis = aggs['kpis']
 
     # --- TÍTULO E KPIs ---
     st.title("🛡️ Painel de Monitoramento: Violência na TI Yanomami")
@@ -75,20 +275,17 @@ if df is not None:
 
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total de Casos Notificados", len(df_filtered))
+        st.metric("Total de Casos Notificados", kpis['total'])
     with col2:
         # Contagem de Violência Física
-        viol_fisica = len(df_filtered[df_filtered['VIOL_FISIC'] == 1])
-        st.metric("Casos c/ Violência Física", viol_fisica)
+        st.metric("Casos c/ Violência Física", kpis['viol_fisica'])
     with col3:
         # Uso de Álcool
-        alcool_sim = len(df_filtered[df_filtered.get('AUTOR_ALCO') == 1])
-        pct_alcool = (alcool_sim / len(df_filtered) * 100) if len(df_filtered) > 0 else 0
+        pct_alcool = (kpis['alcool_sim'] / kpis['total'] * 100) if kpis['total'] > 0 else 0
         st.metric("Suspeita de Álcool (Autor)", f"{pct_alcool:.1f}%", help="Porcentagem de casos onde houve uso de álcool pelo autor")
     with col4:
         # Faixa Etária Principal
-        top_faixa = df_filtered['FAIXA_ETARIA'].value_counts().idxmax() if not df_filtered.empty else "-"
-        st.metric("Faixa Etária + Atingida", top_faixa)
+        st.metric("Faixa Etária + Atingida", kpis['top_faixa'])
 
     # --- LINHA 1: PERFIL DA VÍTIMA ---
     st.markdown("### 1. Perfil da Vítima")
@@ -96,26 +293,21 @@ if df is not None:
 
     with row1_col1:
         # Gráfico de Faixa Etária
-        contagem_etaria = df_filtered['FAIXA_ETARIA'].value_counts().sort_index().reset_index()
-        contagem_etaria.columns = ['Faixa Etária', 'Qtd']
-        
-        fig_etaria = px.bar(
-            contagem_etaria, x='Faixa Etária', y='Qtd', 
-            text='Qtd', title="Distribuição por Faixa Etária",
-            color_discrete_sequence=['#FF6B6B']
+        contagem_etaria = aggs['contagem_etaria']
+        qtd_etaria = tuple(contagem_etaria)
+        fig_etaria = fig_barras(
+            tuple(contagem_etaria.index), qtd_etaria,
+            "Distribuição por Faixa Etária", 'Faixa Etária', 'Qtd', '#FF6B6B', texto=qtd_etaria
         )
         st.plotly_chart(fig_etaria, use_container_width=True)
 
     with row1_col2:
         # Gráfico Situação Conjugal
-        if 'SIT_CONJUG_DESC' in df_filtered.columns:
-            contagem_conjugal = df_filtered['SIT_CONJUG_DESC'].value_counts().reset_index()
-            contagem_conjugal.columns = ['Situação', 'Qtd']
-            
-            fig_conjugal = px.pie(
-                contagem_conjugal, names='Situação', values='Qtd', 
-                title="Situação Conjugal", hole=0.4,
-                color_discrete_sequence=px.colors.sequential.RdBu
+        contagem_conjugal = aggs['contagem_conjugal']
+        if contagem_conjugal is not None:
+            fig_conjugal = fig_pizza(
+                tuple(contagem_conjugal.index), tuple(contagem_conjugal),
+                "Situação Conjugal", cores=tuple(sequential.RdBu), furo=0.4
             )
             st.plotly_chart(fig_conjugal, use_container_width=True)
 
@@ -125,39 +317,21 @@ if df is not None:
 
     with row2_col1:
         # Tipos de Violência (Multiplas escolhas)
-        cols_violencia = {
-            'VIOL_FISIC': 'Física', 'VIOL_PSICO': 'Psicológica', 'VIOL_SEXU': 'Sexual', 
-            'VIOL_TORT': 'Tortura', 'VIOL_FINAN': 'Patrimonial', 'VIOL_NEGLI': 'Negligência'
-        }
-        dados_violencia = {}
-        for col, nome in cols_violencia.items():
-            if col in df_filtered.columns:
-                dados_violencia[nome] = len(df_filtered[df_filtered[col] == 1])
-        
-        df_viol_tipo = pd.DataFrame(list(dados_violencia.items()), columns=['Tipo', 'Qtd']).sort_values('Qtd', ascending=True)
-        
-        fig_viol = px.bar(
-            df_viol_tipo, x='Qtd', y='Tipo', orientation='h', text='Qtd',
-            title="Tipos de Violência (Múltipla escolha)",
-            color='Qtd', color_continuous_scale='Reds'
+        viol_tipo = aggs['viol_tipo']
+        qtd_viol = tuple(viol_tipo)
+        fig_viol = fig_barras(
+            qtd_viol, tuple(viol_tipo.index),
+            "Tipos de Violência (Múltipla escolha)", 'Qtd', 'Tipo', qtd_viol,
+            texto=qtd_viol, orientacao='h', escala='Reds'
         )
         st.plotly_chart(fig_viol, use_container_width=True)
 
     with row2_col2:
         # Meio Utilizado (Top 5)
-        cols_meio = [c for c in df_filtered.columns if c.startswith('AG_') and c != 'AG_OUTROS']
-        dados_meio = {}
-        for col in cols_meio:
-            qtd = len(df_filtered[df_filtered[col] == 1])
-            if qtd > 0:
-                nome_limpo = col.replace('AG_', '').title()
-                dados_meio[nome_limpo] = qtd
-        
-        df_meio = pd.DataFrame(list(dados_meio.items()), columns=['Meio', 'Qtd']).sort_values('Qtd', ascending=False).head(5)
-        
-        fig_meio = px.bar(
-            df_meio, x='Meio', y='Qtd', title="Meios + Utilizados (Top 5)",
-            color_discrete_sequence=['#FFA07A']
+        meio = aggs['meio']
+        fig_meio = fig_barras(
+            tuple(meio.index), tuple(meio),
+            "Meios + Utilizados (Top 5)", 'Meio', 'Qtd', '#FFA07A'
         )
         st.plotly_chart(fig_meio, use_container_width=True)
 
@@ -167,44 +341,31 @@ if df is not None:
 
     with row3_col1:
         # Vínculo
-        cols_vinculo = [c for c in df_filtered.columns if c.startswith('REL_') and c != 'REL_TRAB']
-        dados_vinculo = {}
-        for col in cols_vinculo:
-            qtd = len(df_filtered[df_filtered[col] == 1])
-            if qtd > 0:
-                nome_limpo = col.replace('REL_', '').title()
-                dados_vinculo[nome_limpo] = qtd
-        
-        df_vinculo = pd.DataFrame(list(dados_vinculo.items()), columns=['Vínculo', 'Qtd']).sort_values('Qtd', ascending=False).head(7)
-        
-        fig_vinculo = px.bar(
-            df_vinculo, x='Vínculo', y='Qtd', title="Vínculo com a Vítima",
-            color_discrete_sequence=['#4682B4']
+        vinculo = aggs['vinculo']
+        fig_vinculo = fig_barras(
+            tuple(vinculo.index), tuple(vinculo),
+            "Vínculo com a Vítima", 'Vínculo', 'Qtd', '#4682B4'
         )
         st.plotly_chart(fig_vinculo, use_container_width=True)
 
     with row3_col2:
         # Uso de Álcool
-        if 'ALCOOL_DESC' in df_filtered.columns:
-            alcool_counts = df_filtered['ALCOOL_DESC'].value_counts().reset_index()
-            alcool_counts.columns = ['Uso Álcool', 'Qtd']
-            
-            fig_alcool = px.pie(
-                alcool_counts, names='Uso Álcool', values='Qtd', 
-                title="Suspeita de Uso de Álcool",
-                color_discrete_map={'Sim': '#FF4B4B', 'Não': '#87CEEB', 'Ignorado': '#D3D3D3'}
+        alcool_counts = aggs['alcool_counts']
+        if alcool_counts is not None:
+            rotulos_alcool = tuple(alcool_counts.index)
+            fig_alcool = fig_pizza(
+                rotulos_alcool, tuple(alcool_counts), "Suspeita de Uso de Álcool",
+                cores=tuple(CORES_ALCOOL.get(r, '#A9A9A9') for r in rotulos_alcool)
             )
             st.plotly_chart(fig_alcool, use_container_width=True)
 
     with row3_col3:
         # Sexo do Autor
-        if 'AUTOR_SEXO' in df_filtered.columns:
-            map_sexo = {1: 'Masculino', 2: 'Feminino', 3: 'Ambos', 9: 'Ignorado'}
-            df_filtered['SEXO_AUTOR_DESC'] = df_filtered['AUTOR_SEXO'].map(map_sexo).fillna('Ignorado')
-            sexo_counts = df_filtered['SEXO_AUTOR_DESC'].value_counts().reset_index()
-            sexo_counts.columns = ['Sexo', 'Qtd']
-            
-            fig_sexo = px.pie(sexo_counts, names='Sexo', values='Qtd', title="Sexo do Autor", hole=0.4)
+        sexo_counts = aggs['sexo_counts']
+        if sexo_counts is not None:
+            fig_sexo = fig_pizza(
+                tuple(sexo_counts.index), tuple(sexo_counts), "Sexo do Autor", furo=0.4
+            )
             st.plotly_chart(fig_sexo, use_container_width=True)
 
     # --- RODAPÉ ---